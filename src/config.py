@@ -3,3 +3,4 @@ import os
 AUTH_HOST = os.getenv("AUTH_HOST", "localhost")
 PUBLIC_KEYS_URL: str = f"http://{AUTH_HOST}:8000/public-keys"
 ALGORITHM: str = "RS256"
+JWKS_REFRESH_INTERVAL: float = float(os.getenv("JWKS_REFRESH_INTERVAL", 600))
@@ -1,93 +1,218 @@
+import asyncio
 import logging
-import random
+import time
 import uuid
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from typing import Any, AsyncGenerator
+from functools import lru_cache, partial
+from typing import Any, AsyncGenerator, Callable, NamedTuple
 
 import httpx
 import jwt
-from fastapi import FastAPI, HTTPException
+import numpy as np
+import orjson
+from jwt.utils import base64url_decode
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.params import Depends, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette import status
 
-from src.config import PUBLIC_KEYS_URL, ALGORITHM
+from src.config import PUBLIC_KEYS_URL, ALGORITHM, JWKS_REFRESH_INTERVAL
 
 logger = logging.getLogger("uvicorn")
-public_keys: dict[str, str]
+
+# Auth failures with a fixed detail are built once and re-raised; `with_traceback(None)`
+# keeps the traceback of a shared instance from growing with every raise
+TOKEN_EXPIRED = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
+INVALID_TOKEN = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+INVALID_KEY_ID = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid key id")
+INVALID_TOKEN_TYPE = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token type: expected 'access'")
+
+# Verified token payloads keyed by the raw token, expiring with the token's own `exp` claim
+jwt_cache_max_size = 10_000
+jwt_cache: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
 
 num_users = 10
 num_orders_per_user = 5
 
+
+# Checks a signature against the signing input, raising jwt.InvalidSignatureError on mismatch
+Verifier = Callable[[bytes, bytes], None]
+
+
+class KeyStore:
+    """Signature verifiers for the auth service keys, replaced as a whole under `lock` on refetch."""
+    __slots__ = ("keys", "lock")
+
+    def __init__(self, keys: dict[str, Verifier]) -> None:
+        self.keys = keys
+        self.lock = asyncio.Lock()
+
+
+class FakeOrders(NamedTuple):
+    """Fake orders stored column-wise: row i of every column describes the same order."""
+    order_ids: np.ndarray
+    user_ids: np.ndarray
+    products: np.ndarray
+    quantities: np.ndarray
+    prices: np.ndarray
+
+
 fake_users: list[dict[str, Any]] = []
-fake_orders: list[dict[str, Any]] = []
+fake_orders: FakeOrders
+fake_users_by_id: dict[int, dict[str, Any]] = {}
+# Rows of fake_orders for each user; the orders of one user are stored contiguously
+fake_orders_by_user: dict[int, slice] = {}
+
+rng = np.random.default_rng()
 
 def generate_fake_users(num_users: int):
     first_names = ["John", "Jane", "Alice", "Bob", "Patrick", "Sandy", "Tom", "Jerry", "Chris", "Anna"]
     last_names = ["Smith", "Doe", "Johnson", "Brown", "Davis", "Miller", "Wilson", "Taylor", "Anderson", "Thomas"]
 
+    # Все случайные значения генерируются одним вызовом на столбец
+    first_idx = rng.integers(0, len(first_names), size=num_users).tolist()
+    last_idx = rng.integers(0, len(last_names), size=num_users).tolist()
+    suffixes = rng.integers(1, 101, size=num_users).tolist()
+
     users = []
-    for user_id in range(num_users):  # ID начинается с 0
-        first_name = random.choice(first_names)
-        last_name = random.choice(last_names)
-        username = f"{first_name.lower()}.{last_name.lower()}{random.randint(1, 100)}"  # Генерация уникального имени пользователя
-        email = f"{username}@example.com"  # Формат email
+    for user_id, (first, last, suffix) in enumerate(zip(first_idx, last_idx, suffixes)):  # ID начинается с 0
+        username = f"{first_names[first].lower()}.{last_names[last].lower()}{suffix}"  # Генерация уникального имени пользователя
         users.append({
             "id": user_id,  # Уникальный ID
             "username": username,
-            "email": email
+            "email": f"{username}@example.com"  # Формат email
         })
     return users
 
-def generate_fake_orders(users: list[dict[str, Any]], num_orders_per_user: int):
-    products = ["Laptop", "Smartphone", "Tablet", "Headphones", "Charger"]
-    orders = []
+def generate_fake_orders(users: list[dict[str, Any]], num_orders_per_user: int) -> FakeOrders:
+    products = np.array(["Laptop", "Smartphone", "Tablet", "Headphones", "Charger"])
 
-    for user in users:
-        for _ in range(random.randint(1, num_orders_per_user)):  # Каждый пользователь может иметь от 1 до num_orders_per_user заказов
-            order = {
-                "order_id": str(uuid.uuid4()),  # Генерация уникального идентификатора заказа
-                "user_id": user["id"],  # Привязка заказа к id пользователя
-                "product": random.choice(products),
-                "quantity": random.randint(1, 3),  # Случайное количество от 1 до 3
-                "price": round(random.uniform(10.0, 500.0), 2)  # Случайная цена от 10 до 500
-            }
-            orders.append(order)
+    # Каждый пользователь может иметь от 1 до num_orders_per_user заказов
+    counts = rng.integers(1, num_orders_per_user + 1, size=len(users))
+    total = int(counts.sum())
 
-    return orders
+    return FakeOrders(
+        order_ids=np.array([str(uuid.uuid4()) for _ in range(total)]),  # Генерация уникального идентификатора заказа
+        user_ids=np.repeat(np.array([user["id"] for user in users], dtype=np.int64), counts),  # Привязка заказа к id пользователя
+        products=products[rng.integers(0, len(products), size=total)],
+        quantities=rng.integers(1, 4, size=total),  # Случайное количество от 1 до 3
+        prices=np.round(rng.uniform(10.0, 500.0, size=total), 2),  # Случайная цена от 10 до 500
+    )
 
-async def fetch_public_keys() -> dict[str, str]:
+async def fetch_public_keys() -> dict[str, Verifier] | None:
     """
     Fetches public keys from the authentication server via an asynchronous HTTP request.
 
+    The shared client stored on ``app.state.http_client`` is reused, so keep-alive
+    connections to the auth service survive between refetches. PEM-encoded keys are
+    parsed once here and bound into per-kid verifiers, so token verification neither
+    re-parses keys nor rebuilds the padding and hash objects on every request.
+
+    Returns None if the auth service is unreachable, responds with an error status
+    or returns a malformed body. Individual keys that cannot be parsed are skipped.
+
     Raises:
-        httpx.HTTPError: If the request to the authentication server fails.
+        httpx.HTTPError: If the request to the authentication server fails otherwise.
+    """
+    try:
+        response = await app.state.http_client.post(PUBLIC_KEYS_URL)
+        response.raise_for_status()
+        raw_keys = orjson.loads(response.content)
+        if not isinstance(raw_keys, dict):
+            logger.warning("The auth service at %s returned public keys in an unexpected format", PUBLIC_KEYS_URL)
+            return None
+        keys = {}
+        for kid, pem in raw_keys.items():
+            # A single malformed key must not invalidate the rest of the key set
+            if not isinstance(pem, str):
+                logger.warning("Skipping public key %s: expected a PEM string", kid)
+                continue
+            try:
+                key = load_pem_public_key(pem.encode())
+            except (ValueError, UnsupportedAlgorithm):
+                logger.warning("Skipping public key %s: unable to parse PEM", kid)
+                continue
+            if isinstance(key, RSAPublicKey):
+                keys[kid] = make_verifier(key)
+            else:
+                logger.warning("Skipping public key %s: %s requires an RSA key", kid, ALGORITHM)
+        return keys
+    except httpx.ConnectTimeout:
+        logger.warning("Connection timeout while trying to reach the auth service at %s", PUBLIC_KEYS_URL)
+    except httpx.ConnectError:
+        logger.warning("Unable to connect to the authentication service at %s. Please check if the service is running.", PUBLIC_KEYS_URL)
+    except httpx.HTTPStatusError as e:
+        logger.warning("The auth service at %s responded with status %s", PUBLIC_KEYS_URL, e.response.status_code)
+    except orjson.JSONDecodeError:
+        logger.warning("The auth service at %s returned a response that is not valid JSON", PUBLIC_KEYS_URL)
+
+
+async def refresh_public_keys_periodically(store: KeyStore) -> None:
+    """
+    Refetches public keys every JWKS_REFRESH_INTERVAL seconds so that rotated keys
+    are usually known before the first token signed with them arrives.
     """
-    async with httpx.AsyncClient() as client:
+    while True:
+        await asyncio.sleep(JWKS_REFRESH_INTERVAL)
         try:
-            response = await client.post(PUBLIC_KEYS_URL)
-            return response.json()
-        except httpx.ConnectTimeout:
-            logger.warning("Connection timeout while trying to reach the auth service at %s", PUBLIC_KEYS_URL)
-        except httpx.ConnectError:
-            logger.warning("Unable to connect to the authentication service at %s. Please check if the service is running.", PUBLIC_KEYS_URL)
+            keys = await fetch_public_keys()
+        except Exception:
+            # A malformed response must not stop the refresh loop for the rest of the process
+            logger.exception("Failed to refresh public keys")
+            continue
+        if keys is not None:
+            async with store.lock:
+                store.keys = keys
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
-    global public_keys
     global fake_users
     global fake_orders
+    global fake_users_by_id
+    global fake_orders_by_user
 
-    public_keys = await fetch_public_keys()
-    fake_users = generate_fake_users(num_users)
-    fake_orders = generate_fake_orders(fake_users, num_orders_per_user)
-    yield
+    async with httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        timeout=10.0,
+    ) as http_client:
+        _app.state.http_client = http_client
+        _app.state.key_store = KeyStore(await fetch_public_keys() or {})
+        fake_users = generate_fake_users(num_users)
+        fake_orders = generate_fake_orders(fake_users, num_orders_per_user)
+        fake_users_by_id = {user["id"]: user for user in fake_users}
+        # Boundaries between users are the positions where user_id changes: O(N) in total
+        starts = np.flatnonzero(np.diff(fake_orders.user_ids, prepend=-1)).tolist()
+        stops = starts[1:] + [len(fake_orders.user_ids)]
+        fake_orders_by_user = {
+            user_id: slice(start, stop)
+            for user_id, start, stop in zip(fake_orders.user_ids[starts].tolist(), starts, stops)
+        }
+        refresher = asyncio.create_task(refresh_public_keys_periodically(_app.state.key_store))
+        yield
+        refresher.cancel()
+        try:
+            await refresher
+        except asyncio.CancelledError:
+            pass
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
+async def get_key_store(request: Request) -> KeyStore:
+    return request.app.state.key_store
 
-app = FastAPI(lifespan=lifespan)
 
-async def jwt_auth(auth_credentials: HTTPAuthorizationCredentials = Security(HTTPBearer())) -> None:
+async def jwt_auth(auth_credentials: HTTPAuthorizationCredentials = Security(HTTPBearer()),
+                   key_store: KeyStore = Depends(get_key_store)) -> None:
     """
     Performs JWT authentication for incoming requests.
 
@@ -97,43 +222,135 @@ async def jwt_auth(auth_credentials: HTTPAuthorizationCredentials = Security(HTT
 
     Args:
         auth_credentials: The authorization credentials containing the JWT token.
+        key_store: The store holding the public keys of the auth service.
 
     Raises:
         HTTPException: If the token is expired, invalid, or does not have the correct type.
     """
+    token = auth_credentials.credentials
+    if get_cached_payload(token) is not None:
+        return
+
+    # Errors are mapped to 401 only around the parsing of the token itself, so failures
+    # while fetching public keys are not disguised as invalid tokens
+    try:
+        header_segment, payload_segment, signature_segment = token.split(".")
+        unverified_payload = orjson.loads(base64url_decode(payload_segment))
+        token_type = unverified_payload["type"]
+        key_id = kid_from_header_segment(header_segment)
+        signing_input = f"{header_segment}.{payload_segment}".encode()
+        signature = base64url_decode(signature_segment)
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        raise INVALID_TOKEN.with_traceback(None) from None
+
+    # The type claim is checked before the signature, so tokens of the wrong
+    # type are rejected without paying for RSA verification
+    if token_type != "access":
+        raise INVALID_TOKEN_TYPE.with_traceback(None)
+
+    verifier = await get_verifier(key_store, key_id)
     try:
-        token = auth_credentials.credentials
-        unverified_header = jwt.get_unverified_header(token)
-        key_id = unverified_header["kid"]
-        public_key = await get_public_key(key_id)
-        payload = jwt.decode(token, public_key, algorithms=[ALGORITHM])
-
-        if payload["type"] != "access":
-            raise HTTPException(
-                status.HTTP_401_UNAUTHORIZED,
-                detail=f"Invalid token type: expected 'access', got '{payload["type"]}'"
-            )
+        verifier(signing_input, signature)
+        # Only the claims this service relies on are validated: `exp` is required,
+        # `aud`, `iss` and `nbf` are not used and therefore not checked
+        if "exp" not in unverified_payload:
+            raise jwt.MissingRequiredClaimError("exp")
+        exp = unverified_payload["exp"]
+        if not isinstance(exp, (int, float)) or isinstance(exp, bool):
+            raise jwt.DecodeError("Expiration Time claim (exp) must be an integer.")
+        if exp <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
     except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-    except (jwt.PyJWTError, KeyError):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        raise TOKEN_EXPIRED.with_traceback(None) from None
+    except jwt.PyJWTError:
+        raise INVALID_TOKEN.with_traceback(None) from None
+    cache_payload(token, exp, unverified_payload)
+
 
+@lru_cache(maxsize=4096)
+def kid_from_header_segment(header_segment: str) -> str:
+    """
+    Extracts the key id from the base64url-encoded JWT header segment and checks
+    that the token is signed with the expected algorithm.
 
-async def get_public_key(key_id: str) -> str:
+    Tokens issued with the same key share an identical header segment, so the
+    decoded result is memoized instead of being parsed on every request.
     """
-    Retrieves the public key associated with the given key_id.
+    header = orjson.loads(base64url_decode(header_segment))
+    if header["alg"] != ALGORITHM:
+        raise jwt.InvalidAlgorithmError("The specified alg value is not allowed")
+    return header["kid"]
+
+
+def verify_rs256(signing_input: bytes, signature: bytes, *, public_key: RSAPublicKey,
+                 pad: padding.AsymmetricPadding, algorithm: hashes.HashAlgorithm) -> None:
+    """
+    Verifies an RS256 signature directly with `cryptography`, bypassing the generic
+    algorithm dispatch and claim validation of `jwt.decode`.
+
+    Raises:
+        jwt.InvalidSignatureError: If the signature does not match.
+    """
+    try:
+        public_key.verify(signature, signing_input, pad, algorithm)
+    except InvalidSignature:
+        raise jwt.InvalidSignatureError("Signature verification failed")
+
+
+def make_verifier(public_key: RSAPublicKey) -> Verifier:
+    """Binds the public key, padding and hash objects of RS256 into a single verifier."""
+    return partial(verify_rs256, public_key=public_key, pad=padding.PKCS1v15(), algorithm=hashes.SHA256())
+
+
+def get_cached_payload(token: str) -> dict[str, Any] | None:
+    """
+    Returns the previously verified payload of the token, or None if the token is
+    not cached or has already expired.
+    """
+    entry = jwt_cache.get(token)
+    if entry is None:
+        return None
+    expires_at, payload = entry
+    if expires_at <= time.time():
+        del jwt_cache[token]
+        return None
+    jwt_cache.move_to_end(token)
+    return payload
+
+
+def cache_payload(token: str, exp: float, payload: dict[str, Any]) -> None:
+    """
+    Stores a successfully verified payload until its `exp` claim. The least recently
+    used entry is evicted when the cache is full.
+    """
+    jwt_cache[token] = (exp, payload)
+    if len(jwt_cache) > jwt_cache_max_size:
+        jwt_cache.popitem(last=False)
+
+
+async def get_verifier(store: KeyStore, key_id: str) -> Verifier:
+    """
+    Retrieves the signature verifier of the public key associated with the given key_id.
 
     If the key_id is not found in the cached public keys, the function fetches
-    the latest public keys asynchronously. If the key_id is still not found
-    after updating, an HTTP 401 Unauthorized exception is raised.
+    the latest public keys asynchronously. The refetch is guarded by a lock, so
+    concurrent misses result in a single request to the auth service. If the key_id
+    is still not found after updating, an HTTP 401 Unauthorized exception is raised.
     """
-    global public_keys
+    verifier = store.keys.get(key_id)
+    if verifier is not None:
+        return verifier
 
-    if key_id not in public_keys:
-        public_keys = await fetch_public_keys()
-    if key_id not in public_keys:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid key id")
-    return public_keys[key_id]
+    async with store.lock:
+        if key_id not in store.keys:
+            keys = await fetch_public_keys()
+            # The previous keys are kept if the auth service is unavailable
+            if keys is not None:
+                store.keys = keys
+        verifier = store.keys.get(key_id)
+    if verifier is None:
+        raise INVALID_KEY_ID.with_traceback(None)
+    return verifier
 
 
 @app.post("/protected",
@@ -148,16 +365,28 @@ async def protected() -> Any:
 @app.get("/users/{user_id}",
          summary="[Fake] Get user by id")
 async def users(user_id: int) -> dict[str, dict[str, Any]]:
-    for user in fake_users:
-        if user["id"] == user_id:
-            return {"user": user}
-    raise HTTPException(status_code=404, detail=f"User with id {user_id} not found")
+    try:
+        return {"user": fake_users_by_id[user_id]}
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"User with id {user_id} not found")
 
 @app.get("/orders/{user_id}",
          summary="[Fake] Get order by user id")
 async def orders(user_id: int) -> dict[str, list[dict[str, Any]]]:
-    user_orders = []
-    for order in fake_orders:
-        if order["user_id"] == user_id:
-            user_orders.append(order)
-    return {"orders": user_orders}
\ No newline at end of file
+    rows = fake_orders_by_user.get(user_id)
+    if rows is None:
+        return {"orders": []}
+
+    # Only the matching rows are materialized into dicts
+    columns = zip(
+        fake_orders.order_ids[rows].tolist(),
+        fake_orders.products[rows].tolist(),
+        fake_orders.quantities[rows].tolist(),
+        fake_orders.prices[rows].tolist(),
+    )
+    return {
+        "orders": [
+            {"order_id": order_id, "user_id": user_id, "product": product, "quantity": quantity, "price": price}
+            for order_id, product, quantity, price in columns
+        ]
+    }
\ No newline at end of file